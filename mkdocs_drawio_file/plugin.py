@@ -1,20 +1,101 @@
 import os
 import re
-import string
 import logging
+import functools
+import posixpath
+from html import unescape
+import concurrent.futures
 import mkdocs
-import requests
 from lxml import etree
 from bs4 import BeautifulSoup
 from mkdocs.plugins import BasePlugin
+from mkdocs.structure.files import File
+from mkdocs.utils import get_relative_url
 
 
 # ------------------------
 # Constants and utilities
 # ------------------------
 RE_PATTERN = r'!\[(.*?)\]\((.*?.drawio)\)'
-SUB_TEMPLATE = string.Template(
-        "<div class=\"mxgraph\" style=\"max-width:100%;border:1px solid transparent;\" data-mxgraph=\"{&quot;highlight&quot;:&quot;#0000ff&quot;,&quot;nav&quot;:true,&quot;resize&quot;:true,&quot;toolbar&quot;:&quot;zoom layers tags lightbox&quot;,&quot;edit&quot;:&quot;_blank&quot;,&quot;xml&quot;:&quot;$xml_drawio&quot;}\"></div>")
+VIEWER_SCRIPT_NAME = "viewer-static.min.js"
+_STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# compiled once at import; re.search semantics make a leading '.*' redundant
+_DRAWIO_SRC_RE = re.compile(r'\.drawio', re.IGNORECASE)
+# mkdocs/markdown emit img tags with double-quoted attributes, so the
+# common case can be spliced with a regex and no document parse; anything
+# this does not match falls back to the BeautifulSoup pass
+_IMG_TAG_RE = re.compile(
+    r'<img\b[^>]*?\bsrc="([^"]*\.drawio[^"]*)"[^>]*?/?>', re.IGNORECASE)
+_ALT_ATTR_RE = re.compile(r'\balt="([^"]*)"', re.IGNORECASE)
+# tuned for machine-generated .drawio files: skip the XML ID table and
+# whitespace-only text nodes; entity and network resolution stay off,
+# which also hardens against XXE in checked-in diagram files
+_XML_PARSER = etree.XMLParser(
+    collect_ids=False,
+    remove_blank_text=True,
+    resolve_entities=False,
+    no_network=True,
+)
+# entity-escape the diagram XML for the data-mxgraph attribute in a single
+# C-level pass; '"' also gets the JSON backslash since the attribute value
+# is a JSON object, and newlines are dropped outright
+_ESCAPE_TABLE = str.maketrans({
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    "\"": "\\&quot;",
+    "'": "&apos;",
+    "\n": "",
+})
+# the diagram markup is fixed apart from the escaped XML payload, so a
+# plain concatenation of the two halves replaces a string.Template, which
+# re-scans the template for $ identifiers on every substitution
+SUB_PREFIX = "<div class=\"mxgraph\" style=\"max-width:100%;border:1px solid transparent;\" data-mxgraph=\"{&quot;highlight&quot;:&quot;#0000ff&quot;,&quot;nav&quot;:true,&quot;resize&quot;:true,&quot;toolbar&quot;:&quot;zoom layers tags lightbox&quot;,&quot;edit&quot;:&quot;_blank&quot;,&quot;xml&quot;:&quot;"
+SUB_SUFFIX = "&quot;}\"></div>"
+# compiled once; $name is bound per call, so page names containing
+# quotes cannot break out of the expression
+_DIAGRAM_BY_NAME = etree.XPath("./diagram[@name=$name]")
+
+
+@functools.lru_cache(maxsize=512)
+def _render_diagram(full_path, mtime, alt):
+    """Render one diagram reference to its final <div> markup.
+
+    Lives at module level so the cache survives the plugin
+    re-instantiation mkdocs serve performs on every rebuild; mtime is
+    part of the key purely to invalidate entries for edited files.
+    """
+    if not alt:
+        # the whole file is embedded as-is, so the raw text is already
+        # what we need; skip the parse + re-serialize round trip
+        with open(full_path, encoding="utf-8") as f:
+            diagram = f.read()
+    else:
+        diagram_xml = etree.parse(full_path, _XML_PARSER)
+        diagram = _parse_diagram(diagram_xml, alt)
+
+    return SUB_PREFIX + diagram.translate(_ESCAPE_TABLE) + SUB_SUFFIX
+
+
+def _parse_diagram(data, alt):
+    # the root element of a .drawio file is always <mxfile>
+    mxfile = data.getroot()
+
+    try:
+        # try to parse for a specific page by using the alt attribute
+        page = _DIAGRAM_BY_NAME(mxfile, name=alt)
+
+        if len(page) == 1:
+            result = etree.Element(mxfile.tag, mxfile.attrib)
+            result.append(page[0])
+            return etree.tostring(result, encoding=str)
+        else:
+            print(f"Warning: Found {len(page)} results for page name '{alt}'")
+    except etree.XPathError:
+        print(f"Error: Could not properly parse page name: '{alt}'")
+
+    return etree.tostring(mxfile, encoding=str)
+
 
 # ------------------------
 # Plugin
@@ -28,86 +109,145 @@ class DrawioFilePlugin(BasePlugin):
             "file_extension",
             mkdocs.config.config_options.Type(str, default=".drawio"),
         ),
+        (
+            "parallel_diagrams",
+            mkdocs.config.config_options.Type(bool, default=False),
+        ),
     )
 
     def __init__(self):
         self.log = logging.getLogger("mkdocs.plugins.diagrams")
         self.pool = None
 
+    def on_files(self, files, config):
+        # register the bundled viewer once per build; mkdocs copies it
+        # into site_dir alongside the other static files. Guard against
+        # a second append in case another hook already provided it.
+        if not any(f.src_path == VIEWER_SCRIPT_NAME for f in files):
+            files.append(File(
+                path=VIEWER_SCRIPT_NAME,
+                src_dir=_STATIC_DIR,
+                dest_dir=os.path.join(config["site_dir"], "js"),
+                use_directory_urls=False,
+            ))
+        return files
+
     def on_post_page(self, output_content, config, page, **kwargs):
-        if ".drawio" not in output_content.lower():
-            # Skip unecessary HTML parsing
+        if not _DRAWIO_SRC_RE.search(output_content):
+            # Skip unecessary HTML parsing; the case-insensitive regex
+            # scan avoids allocating a lowercased copy of the whole page
             return output_content
 
-        soup = BeautifulSoup(output_content, 'html.parser')
+        docs_dir = config["docs_dir"]
 
-        # search for images using drawio extension
-        diagrams = soup.findAll('img', src=re.compile(r'.*\.drawio', re.IGNORECASE))
-        if len(diagrams) == 0:
-            return output_content
+        matches = list(_IMG_TAG_RE.finditer(output_content))
+        if not matches:
+            # '.drawio' occurs outside a conventional img tag; let the
+            # full parser decide whether anything needs substituting
+            return self._substitute_with_soup(output_content, page, docs_dir)
 
-        # Step 1: Fetch the JavaScript file content
-        js_url = "https://viewer.diagrams.net/js/viewer-static.min.js"
-        response = requests.get(js_url,verify=False)
-        if response.status_code == 200:
-            js_content = response.text
+        def _render(match):
+            # attribute values are entity-escaped in the page source;
+            # the soup path hands them to us decoded, so do the same
+            alt_match = _ALT_ATTR_RE.search(match.group(0))
+            return self._try_substitute(
+                docs_dir, page.url, unescape(match.group(1)),
+                unescape(alt_match.group(1)) if alt_match else None)
+
+        if self.config["parallel_diagrams"] and len(matches) > 1:
+            rendered = list(self._get_pool().map(_render, matches))
         else:
-            print(f"Failed to fetch JS file: {response.status_code}")
-            js_content = ""
-        # add drawio library to body
+            rendered = [_render(match) for match in matches]
 
-        lib = soup.new_tag('script')
-        lib.string = js_content
+        if all(html is None for html in rendered):
+            # every substitution failed; leave the page untouched and do
+            # not reference the viewer script
+            return output_content
 
-        # Step 5: Add the script tag to the <body> section or <head> (based on your preference)
-        soup.body.append(lib)
+        # splice the rendered divs straight into the page string,
+        # keeping the original img tag where rendering failed
+        parts = []
+        last = 0
+        for match, html in zip(matches, rendered):
+            parts.append(output_content[last:match.start()])
+            parts.append(html if html is not None else match.group(0))
+            last = match.end()
+        parts.append(output_content[last:])
+
+        script = '<script src="%s"></script>' % get_relative_url(
+            "js/" + VIEWER_SCRIPT_NAME, page.url)
+        return "".join(parts).replace("</body>", script + "</body>", 1)
+
+    def _substitute_with_soup(self, output_content, page, docs_dir):
+        # lxml is already a hard dependency and its C-backed parser is
+        # several times faster than html.parser on full pages
+        soup = BeautifulSoup(output_content, 'lxml')
+
+        # search for images using drawio extension; a plain substring
+        # check beats running the regex against every src attribute
+        diagrams = [img for img in soup.find_all('img')
+                    if '.drawio' in (img.get('src') or '').lower()]
+        if len(diagrams) == 0:
+            return output_content
 
-        # substitute images with embedded drawio diagram
-        path = os.path.dirname(page.file.abs_src_path)
+        # substitute images with embedded drawio diagram; the diagram
+        # reads release the GIL, so multi-diagram pages can run them in
+        # parallel, while the soup mutation stays on this thread
+        if self.config["parallel_diagrams"] and len(diagrams) > 1:
+            substituted = list(self._get_pool().map(
+                lambda d: self._try_substitute(
+                    docs_dir, page.url, d['src'], d['alt']),
+                diagrams))
+        else:
+            substituted = [self._try_substitute(
+                               docs_dir, page.url, d['src'], d['alt'])
+                           for d in diagrams]
+
+        changed = False
+        for diagram, html in zip(diagrams, substituted):
+            if html is None:
+                continue
+            # parse the small fixed-shape fragment with the C-backed
+            # parser and graft only the <div> node instead of splicing
+            # in a whole mini-document per diagram
+            diagram.replace_with(BeautifulSoup(html, 'lxml').div)
+            changed = True
+
+        if not changed:
+            # nothing was replaced; skip the whole-document re-serialize
+            # and do not reference the viewer script
+            return output_content
 
-        for diagram in diagrams:
-            diagram.replace_with(BeautifulSoup(self.substitute_image(path, diagram['src'], diagram['alt']), 'html.parser'))
+        # add drawio library to body; the script itself is copied once by
+        # on_files, so every page only carries a small reference to it
+        lib = soup.new_tag(
+            'script',
+            src=get_relative_url("js/" + VIEWER_SCRIPT_NAME, page.url))
+        soup.body.append(lib)
 
         return str(soup)
 
-    def substitute_image(self, path: str, src: str, alt: str):
-        if src.startswith("../"):
-            src = src[3:]
-
-        diagram_xml = etree.parse(os.path.join(path, src))
-        diagram = self.parse_diagram(diagram_xml, alt)
-        escaped_xml = self.escape_diagram(diagram)
-
-        return SUB_TEMPLATE.substitute(xml_drawio=escaped_xml)
-    
-    def parse_diagram(self, data, alt):
-        if alt == None:
-            return etree.tostring(data, encoding=str)
-
-        mxfile = data.xpath("//mxfile")[0]
-
+    def _try_substitute(self, docs_dir, page_url, src, alt):
         try:
-            # try to parse for a specific page by using the alt attribute
-            page = mxfile.xpath(f"//diagram[@name='{alt}']")
-
-            if len(page) == 1:
-                parser = etree.XMLParser()
-                result = parser.makeelement(mxfile.tag, mxfile.attrib)
-
-                result.append(page[0])
-                return etree.tostring(result, encoding=str)
-            else:
-                print(f"Warning: Found {len(page)} results for page name '{alt}'")
-        except e:
-            print(f"Error: Could not properly parse page name: '{alt}'")
-        
-        return etree.tostring(mxfile, encoding=str)
-
-    def escape_diagram(self, str_xml: str):
-        str_xml = str_xml.replace("&", "&amp;")
-        str_xml = str_xml.replace("<", "&lt;")
-        str_xml = str_xml.replace(">", "&gt;")
-        str_xml = str_xml.replace("\"", "\&quot;")
-        str_xml = str_xml.replace("'", "&apos;")
-        str_xml = str_xml.replace("\n", "")
-        return str_xml
+            return self.substitute_image(docs_dir, page_url, src, alt)
+        except (OSError, etree.XMLSyntaxError) as error:
+            self.log.warning(f"Could not embed diagram '{src}': {error}")
+            return None
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(8, os.cpu_count() or 1))
+        return self.pool
+
+    def substitute_image(self, docs_dir: str, page_url: str, src: str, alt: str):
+        # by on_post_page time mkdocs has rewritten the src relative to
+        # the page's *output* URL, which sits one level deeper than the
+        # source dir under directory URLs. Resolve the reference in URL
+        # space first, then map the result back under docs_dir; this
+        # also handles multi-level '../' references correctly
+        file_url = posixpath.normpath(
+            posixpath.join(posixpath.dirname(page_url), src))
+        full_path = os.path.normpath(
+            os.path.join(docs_dir, *file_url.split("/")))
+        return _render_diagram(full_path, os.path.getmtime(full_path), alt)